@@ -1,9 +1,20 @@
-from networkx import DiGraph, shortest_path
+from math import hypot
+
+import pytest
+from networkx import DiGraph
+from numpy import argsort, concatenate, ravel_multi_index
 
 from vrpy.clarke_wright import _ClarkeWright, _RoundTrip
 from vrpy.greedy import _Greedy
 
 
+def _saving(alg, u, v):
+    """Saving of edge (u, v), looked up among the candidate edges."""
+    n = len(alg._nodes)
+    k = list(alg._candidates).index(alg._index[u] * n + alg._index[v])
+    return alg._savings[k]
+
+
 class TestsInitialSolution:
     """
     Initial solution can be computed with:
@@ -47,19 +58,147 @@ class TestsInitialSolution:
     ###################
 
     def test_initialization(self):
+        self.alg._materialize_tables()
         self.alg._initialize_routes()
-        assert self.alg._route[1].graph["load"] == self.G.nodes[1]["demand"]
-        assert len(self.alg._route[1].nodes()) == 3
+        rid = self.alg._route_id[self.alg._index[1]]
+        assert self.alg._route_load[rid] == self.G.nodes[1]["demand"]
+        assert self.alg._route_stops[rid] == 1
+        assert self.alg._head[rid] == self.alg._tail[rid] == self.alg._index[1]
 
     def test_savings(self):
+        self.alg._materialize_tables()
         self.alg._get_savings()
-        assert self.alg._savings[(1, 2)] == 23
-        assert self.alg._ordered_edges[0] == (1, 2)
+        assert _saving(self.alg, 1, 2) == 23
+        self.alg._initialize_routes()
+        ordered_i, ordered_j = next(self.alg._ordered_edges())
+        i, j = ordered_i[0], ordered_j[0]
+        assert (self.alg._nodes[i], self.alg._nodes[j]) == (1, 2)
+
+    def test_savings_large_depot_costs(self):
+        # Missing depot edges are given a cost of 1e10 by check_vrp
+        self.G.edges["Source", 2]["cost"] = 1e10
+        self.G.edges["Source", 3]["cost"] = 1e10
+        self.G.edges[1, 3]["cost"] = 1
+        self.alg._materialize_tables()
+        self.alg._get_savings()
+        assert _saving(self.alg, 1, 3) == 1e10 + 9
+        self.alg._initialize_routes()
+        ordered_i, ordered_j = next(self.alg._ordered_edges())
+        i, j = ordered_i[0], ordered_j[0]
+        assert (self.alg._nodes[i], self.alg._nodes[j]) == (1, 3)
+
+    def test_savings_alpha_ties(self):
+        # Savings of (1,2) and (1,3) are equal (64.9) with alpha = 1.7
+        self.G.edges["Source", 2]["cost"] = 60
+        self.G.edges["Source", 3]["cost"] = 128
+        self.G.edges[1, 2]["cost"] = 3
+        self.G.edges[1, 3]["cost"] = 43
+        self.alg.alpha = 1.7
+        self.alg._materialize_tables()
+        self.alg._get_savings()
+        assert _saving(self.alg, 1, 2) == _saving(self.alg, 1, 3) == 10 + 60 - 1.7 * 3
+        # Ties are broken by index
+        self.alg._initialize_routes()
+        ordered_i, ordered_j = next(self.alg._ordered_edges())
+        i, j = ordered_i[0], ordered_j[0]
+        assert (self.alg._nodes[i], self.alg._nodes[j]) == (1, 2)
+
+    def _complete_graph(self, n, scale=None):
+        """
+        Complete graph on n customers with Manhattan distances (many ties),
+        or Euclidean distances between coordinates multiplied by scale.
+        """
+        G = DiGraph()
+        coords = {v: ((7 * v) % 19, (11 * v) % 23) for v in range(1, n + 1)}
+        coords["Source"] = coords["Sink"] = (9, 11)
+        if scale:
+            coords = {v: (scale * x, scale * y) for v, (x, y) in coords.items()}
+        for u in coords:
+            for v in coords:
+                if u != v and u != "Sink" and v != "Source":
+                    dx = coords[u][0] - coords[v][0]
+                    dy = coords[u][1] - coords[v][1]
+                    cost = hypot(dx, dy) if scale else abs(dx) + abs(dy)
+                    G.add_edge(u, v, cost=cost, time=cost)
+        for v in range(1, n + 1):
+            G.nodes[v]["demand"] = 1 + v % 3
+        return G
+
+    def test_ordered_edges_blocks(self):
+        alg = _ClarkeWright(self._complete_graph(18), load_capacity=10)
+        alg._materialize_tables()
+        alg._initialize_routes()
+        alg._get_savings()
+        assert len(alg._candidates) > 2 * len(alg._nodes)
+        # Without merges, no edge is dropped between blocks
+        blocks = list(alg._ordered_edges())
+        assert len(blocks) > 1
+        ordered = ravel_multi_index(
+            (
+                concatenate([i for (i, _) in blocks]),
+                concatenate([j for (_, j) in blocks]),
+            ),
+            (len(alg._nodes),) * 2,
+        )
+        expected = alg._candidates[argsort(-alg._savings, kind="stable")]
+        assert list(ordered) == list(expected)
+
+    def test_ordered_edges_float_costs(self):
+        G = self._complete_graph(25, scale=1.1)
+        alg = _ClarkeWright(G, alpha=1.3)
+        alg._materialize_tables()
+        alg._initialize_routes()
+        alg._get_savings()
+        ordered = [
+            (alg._nodes[i], alg._nodes[j])
+            for (ordered_i, ordered_j) in alg._ordered_edges()
+            for (i, j) in zip(ordered_i, ordered_j)
+        ]
+        # Reference: savings stored in a dict and sorted in Python
+        savings = {}
+        for (i, j) in G.edges():
+            if i != "Source" and j != "Sink":
+                savings[(i, j)] = (
+                    G.edges[i, "Sink"]["cost"]
+                    + G.edges["Source", j]["cost"]
+                    - 1.3 * G.edges[i, j]["cost"]
+                )
+        assert ordered == sorted(savings, key=savings.get, reverse=True)
+
+    def test_ordered_edges_result(self):
+        G = self._complete_graph(18)
+        for kwargs in [{}, {"load_capacity": 10}, {"num_stops": 4}]:
+            alg = _ClarkeWright(G, **kwargs)
+            alg.run()
+            # Reference: all candidate edges in a single block
+            ref = _ClarkeWright(G, **kwargs)
+            ref._materialize_tables()
+            ref._initialize_routes()
+            ref._get_savings()
+            order = ref._candidates[argsort(-ref._savings, kind="stable")]
+            n = len(ref._nodes)
+            ref._merge_edges(order // n, order % n)
+            ref._update_routes()
+            assert alg.best_routes == ref.best_routes
+            assert alg.best_value == ref.best_value
+        # Without constraints, all nodes are merged (early return)
+        alg = _ClarkeWright(G)
+        alg.run()
+        assert alg._processed.all()
+
+    def test_feasible_edges(self):
+        self.alg.load_capacity = 3
+        self.alg._materialize_tables()
+        mask = self.alg._feasible_edges()
+        i, j, k = [self.alg._index[v] for v in [1, 2, 3]]
+        assert mask[i, j]
+        assert not mask[i, k]
+        assert not mask[j, i]
 
     def test_result_load(self):
         self.alg.run()
         assert self.alg.best_value == 42
-        assert shortest_path(self.alg._route[1], "Source", "Sink") == [
+        assert self.alg._route[1] == [
             "Source",
             1,
             2,
@@ -70,7 +209,7 @@ class TestsInitialSolution:
         self.alg.duration = 4
         self.alg.run()
         assert self.alg.best_value == 50
-        assert shortest_path(self.alg._route[1], "Source", "Sink") == [
+        assert self.alg._route[1] == [
             "Source",
             1,
             3,
@@ -81,12 +220,89 @@ class TestsInitialSolution:
         self.alg.num_stops = 1
         self.alg.run()
         assert self.alg.best_value == 65
-        assert shortest_path(self.alg._route[1], "Source", "Sink") == [
+        assert self.alg._route[1] == [
             "Source",
             1,
             "Sink",
         ]
 
+    def test_result_source_merge(self):
+        # 3 can only be inserted between Source and 1, once 1-2 is merged
+        G = DiGraph()
+        for (i, j, cost) in [
+            ("Source", 1, 10),
+            ("Source", 2, 15),
+            ("Source", 3, 10),
+            (1, "Sink", 10),
+            (2, "Sink", 5),
+            (3, "Sink", 10),
+            (1, 2, 2),
+            (3, 1, 2),
+            (1, 3, 10),
+        ]:
+            G.add_edge(i, j, cost=cost, time=1)
+        G.edges[2, "Sink"]["time"] = 3
+        for v in [1, 2, 3]:
+            G.nodes[v]["demand"] = G.nodes[v]["service_time"] = 1
+        alg = _ClarkeWright(G, duration=9)
+        alg.run()
+        assert alg.best_value == 19
+        assert alg.best_routes == [["Source", 3, 1, 2, "Sink"]]
+        alg.duration = 8
+        alg.run()
+        assert alg.best_value == 37
+        assert alg._route[3] == ["Source", 3, "Sink"]
+
+    def test_result_rerun(self):
+        self.alg.run()
+        candidates = self.alg._candidates
+        self.alg.alpha = 0.5
+        self.alg.run()
+        assert self.alg.best_value == 42
+        assert len(self.alg.best_routes) == 2
+        assert self.alg._candidates is candidates
+        # Candidates are screened again if constraints change
+        self.alg.load_capacity = 3
+        self.alg.run()
+        assert self.alg._candidates is not candidates
+        assert len(self.alg._candidates) == 1
+
+    def test_savings_beta(self):
+        self.alg.beta = 1
+        self.alg._materialize_tables()
+        self.alg._get_savings()
+        # 23 + |c(Source, 1) - c(2, Sink)|
+        assert _saving(self.alg, 1, 2) == 28
+
+    def test_result_sweep(self):
+        # Paessens' correction (beta > 0) is needed to find the best solution
+        G = DiGraph()
+        depot_cost = {1: 37, 2: 35, 3: 26, 4: 41}
+        cost = {(1, 2): 22, (1, 3): 15, (1, 4): 50, (2, 3): 9, (2, 4): 36, (3, 4): 35}
+        for v in depot_cost:
+            G.add_edge("Source", v, cost=depot_cost[v])
+            G.add_edge(v, "Sink", cost=depot_cost[v])
+        for (i, j) in cost:
+            G.add_edge(i, j, cost=cost[i, j])
+            G.add_edge(j, i, cost=cost[i, j])
+        for (v, demand) in [(1, 4), (2, 2), (3, 1), (4, 4)]:
+            G.nodes[v]["demand"] = demand
+        alg = _ClarkeWright(G, load_capacity=6)
+        alg.run_sweep([0.5, 1], [0, 1], n_workers=2)
+        assert (alg.alpha, alg.beta) == (0.5, 1)
+        assert alg.best_value == 190
+        for v in depot_cost:
+            assert alg._route[v] in alg.best_routes
+        # The linked lists hold the best solution as well
+        assert len(set(alg._route_id)) == len(alg.best_routes)
+        alg.alpha, alg.beta = 1, 0
+        alg.run()
+        assert alg.best_value == 226
+
+    def test_sweep_empty(self):
+        with pytest.raises(ValueError):
+            self.alg.run_sweep([], [0])
+
     ##########
     # Greedy #
     ##########
@@ -77,14 +77,16 @@ def check_vrp(G: DiGraph = None):
             raise NetworkXError("Sink must have no outgoing edges.")
     # Roundtrips should always be possible
     # Missing edges are added with a high cost
-    for v in G.nodes():
-        if v not in ["Source", "Sink"]:
-            if v not in G.successors("Source"):
-                logger.warning("Source not connected to %s" % v)
-                G.add_edge("Source", v, cost=1e10)
-            if v not in G.predecessors("Sink"):
-                logger.warning("%s not connected to Sink" % v)
-                G.add_edge(v, "Sink", cost=1e10)
+    customers = [v for v in G.nodes() if v not in ["Source", "Sink"]]
+    source_successors = set(G.successors("Source"))
+    sink_predecessors = set(G.predecessors("Sink"))
+    for v in customers:
+        if v not in source_successors:
+            logger.warning("Source not connected to %s" % v)
+            G.add_edge("Source", v, cost=1e10)
+        if v not in sink_predecessors:
+            logger.warning("%s not connected to Sink" % v)
+            G.add_edge(v, "Sink", cost=1e10)
     # If graph is disconnected
     if not has_path(G, "Source", "Sink"):
         raise NetworkXError("Source and Sink are not connected.")
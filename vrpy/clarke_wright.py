@@ -1,4 +1,265 @@
-from networkx import DiGraph, add_path, shortest_path
+from concurrent.futures import ProcessPoolExecutor
+
+from numba import njit
+from numpy import (
+    add,
+    arange,
+    array,
+    argsort,
+    bool_,
+    empty,
+    flatnonzero,
+    float64,
+    full,
+    inf,
+    int64,
+    ones,
+    partition,
+    unique,
+    unravel_index,
+    zeros,
+)
+
+# In the arrays below, customers are indexed from 0 to n-1 and -1 stands for
+# the Sink in next_node. Routes are only extended at their ends, and the first
+# and last nodes of each route are stored in head and tail, so routes never
+# need to be walked backwards.
+
+
+@njit(cache=True)
+def _constraints_met(
+    existing_node,
+    new_node,
+    to_sink,
+    route_id,
+    tail,
+    load,
+    time,
+    stops,
+    demand,
+    sink_time,
+    return_time,
+    time_matrix,
+    load_capacity,
+    duration,
+    num_stops,
+):
+    """
+    Tests if new_node can be merged in route without violating constraints.
+    Inactive constraints are passed as None: Numba compiles one version of
+    the merge loop per combination of active constraints, in which the
+    tests of inactive constraints are pruned.
+    Route time is stored without the return to the Sink, and
+    return_time[v] is the service time of v plus the time from v to the Sink.
+    """
+    rid = route_id[existing_node]
+    # test if new_node already in route
+    if route_id[new_node] == rid:
+        return False
+    # test capacity constraints
+    if load_capacity is not None:
+        if load[rid] + demand[new_node] > load_capacity:
+            return False
+    # test duration constraints
+    if duration is not None:
+        new_time = (
+            time[rid] + time_matrix[existing_node, new_node] + return_time[new_node]
+        )
+        if not to_sink:
+            # this code assumes the times to go from the Source and to the Sink are equal
+            new_time += sink_time[tail[rid]] - sink_time[existing_node]
+        if new_time > duration:
+            return False
+    # test stop constraints (a route with num_stops stops is full)
+    if num_stops is not None:
+        if stops[rid] >= num_stops:
+            return False
+    return True
+
+
+@njit(cache=True)
+def _merge_route(
+    existing_node,
+    new_node,
+    to_sink,
+    next_node,
+    route_id,
+    head,
+    tail,
+    is_head,
+    is_tail,
+    load,
+    time,
+    stops,
+    processed,
+    demand,
+    service_time,
+    sink_time,
+    time_matrix,
+):
+    """
+    Merges new_node in existing_node's route.
+    Two possibilities:
+        1. If to_sink, new_node is inserted between existing_node and Sink;
+        2. Otherwise, new_node is inserted between Source and existing_node.
+    """
+    rid = route_id[existing_node]
+    if to_sink:
+        next_node[existing_node] = new_node
+        tail[rid] = new_node
+        is_tail[existing_node] = is_head[new_node] = False
+    else:
+        next_node[new_node] = existing_node
+        head[rid] = new_node
+        is_head[existing_node] = is_tail[new_node] = False
+    load[rid] += demand[new_node]
+    # Route time is stored without the return to the Sink
+    time[rid] += time_matrix[existing_node, new_node] + service_time[new_node]
+    if not to_sink:
+        time[rid] += sink_time[new_node] - sink_time[existing_node]
+    stops[rid] += 1
+    processed[existing_node] = processed[new_node] = True
+    # The round trip of new_node is absorbed
+    route_id[new_node] = rid
+
+
+@njit(cache=True)
+def _cw_merge(
+    ordered_i,
+    ordered_j,
+    next_node,
+    route_id,
+    head,
+    tail,
+    is_head,
+    is_tail,
+    load,
+    time,
+    stops,
+    processed,
+    demand,
+    service_time,
+    has_edge,
+    sink_time,
+    return_time,
+    time_matrix,
+    load_capacity,
+    duration,
+    num_stops,
+):
+    """
+    Attemps to merge nodes i and j together, for all edges (i,j) in order.
+    Merge is possible if :
+        1. vertices have not been merged already;
+        2. route constraints are met;
+        3. either:
+           a) node i is adjacent to the Sink (j is inserted in route[i]);
+           b) or node j is adjacent to the Source (i is inserted in route[j]).
+    """
+    for e in range(len(ordered_i)):
+        i = ordered_i[e]
+        j = ordered_j[e]
+        if (
+            not processed[j]  # 1
+            and is_tail[i]  # 3a
+            and _constraints_met(
+                i,
+                j,
+                True,
+                route_id,
+                tail,
+                load,
+                time,
+                stops,
+                demand,
+                sink_time,
+                return_time,
+                time_matrix,
+                load_capacity,
+                duration,
+                num_stops,
+            )  # 2
+        ):
+            _merge_route(
+                i,
+                j,
+                True,
+                next_node,
+                route_id,
+                head,
+                tail,
+                is_head,
+                is_tail,
+                load,
+                time,
+                stops,
+                processed,
+                demand,
+                service_time,
+                sink_time,
+                time_matrix,
+            )
+        elif (
+            has_edge[j, i]
+            and not processed[i]  # 1
+            and is_head[j]  # 3b
+            and _constraints_met(
+                j,
+                i,
+                False,
+                route_id,
+                tail,
+                load,
+                time,
+                stops,
+                demand,
+                sink_time,
+                return_time,
+                time_matrix,
+                load_capacity,
+                duration,
+                num_stops,
+            )  # 2
+        ):
+            _merge_route(
+                j,
+                i,
+                False,
+                next_node,
+                route_id,
+                head,
+                tail,
+                is_head,
+                is_tail,
+                load,
+                time,
+                stops,
+                processed,
+                demand,
+                service_time,
+                sink_time,
+                time_matrix,
+            )
+
+
+def _first_cost(cost):
+    """If list of costs is given, first item of list is considered."""
+    return cost[0] if isinstance(cost, list) else cost
+
+
+# Instance of _ClarkeWright used by each process of a parameter sweep
+_worker_alg = None
+
+
+def _init_worker(alg):
+    global _worker_alg
+    _worker_alg = alg
+
+
+def _run_worker(params):
+    _worker_alg.alpha, _worker_alg.beta = params
+    _worker_alg.run()
+    return _worker_alg.best_value
 
 
 class _ClarkeWright:
@@ -10,6 +271,10 @@ class _ClarkeWright:
         load_capacity (int, optional) : Maximum load per route. Defaults to None.
         duration (int, optional) : Maximum duration per route. Defaults to None.
         num_stops (int, optional) : Maximum number of stops per route. Defaults to None.
+        alpha (float, optional) : Route shape parameter (weight of c_ij in savings).
+            Defaults to 1.
+        beta (float, optional) : Weight of Paessens' correction |c_0i - c_j0| in savings.
+            Defaults to 0.
     """
 
     def __init__(
@@ -22,17 +287,21 @@ class _ClarkeWright:
         beta=0,
         gamma=0,
     ):
-        self.G = G.copy()
-        self._format_cost()
-        self._savings = {}
-        self._ordered_edges = []
+        self.G = G
+        self._nodes = []
+        self._index = {}
+        self._cost = None
+        self._next = None
+        self._savings = None
+        self._candidates = None
+        self._candidates_ij = None
+        self._candidates_constraints = None
         self._route = {}
         self._best_routes = []
-        self._processed_nodes = []
 
         self.alpha = alpha
+        self.beta = beta
         # FOR MORE SOPHISTICATED VERSIONS OF CLARKE WRIGHT:
-        # self.beta = beta
         # self.gamma = gamma
         # self._average_demand = sum(
         #    [
@@ -50,177 +319,252 @@ class _ClarkeWright:
         self.num_stops = num_stops
 
     def run(self):
-        """Runs Clark & Wrights savings algorithm."""
+        """
+        Runs Clark & Wrights savings algorithm.
+        Tables and route buffers are built on the first run and reused
+        by subsequent runs (e.g. with other values of alpha).
+        """
+        if self._cost is None:
+            self._materialize_tables()
         self._initialize_routes()
         self._get_savings()
-        for (i, j) in self._ordered_edges:
-            self._process_edge(i, j)
+        for (ordered_i, ordered_j) in self._ordered_edges():
+            self._merge_edges(ordered_i, ordered_j)
         self._update_routes()
 
+    def run_sweep(self, alphas, betas=(0,), n_workers=None):
+        """
+        Runs the algorithm for all (alpha, beta) pairs in parallel processes
+        (parallel version of Paessens' savings), then reruns the best pair
+        locally so that alpha, beta and the routes all refer to it.
+
+        Args:
+            alphas (list) : Values of alpha.
+            betas (list, optional) : Values of beta. Defaults to [0].
+            n_workers (int, optional) : Maximum number of processes.
+                Defaults to the number of processors.
+        """
+        if len(alphas) == 0 or len(betas) == 0:
+            raise ValueError("alphas and betas must not be empty.")
+        if self._cost is None:
+            self._materialize_tables()
+        pairs = [(alpha, beta) for alpha in alphas for beta in betas]
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_worker, initargs=(self,)
+        ) as executor:
+            values = list(executor.map(_run_worker, pairs))
+        self.alpha, self.beta = pairs[values.index(min(values))]
+        self.run()
+
+    def _merge_edges(self, ordered_i, ordered_j):
+        """Processes edges (ordered_i[e], ordered_j[e]) in order."""
+        _cw_merge(
+            ordered_i,
+            ordered_j,
+            self._next,
+            self._route_id,
+            self._head,
+            self._tail,
+            self._is_head,
+            self._is_tail,
+            self._route_load,
+            self._route_time,
+            self._route_stops,
+            self._processed,
+            self._demand,
+            self._service_time,
+            self._has_edge,
+            self._sink_time,
+            self._return_time,
+            self._time,
+            self.load_capacity or None,
+            self.duration or None,
+            self.num_stops or None,
+        )
+
     def _initialize_routes(self):
-        """Initialization with round trips (Source - node - Sink)."""
-        for v in self.G.nodes():
-            if v not in ["Source", "Sink"]:
-                # Create round trip
-                round_trip_cost = (
-                    self.G.edges["Source", v]["cost"] + self.G.edges[v, "Sink"]["cost"]
-                )
-                route = DiGraph(cost=round_trip_cost)
-                add_path(route, ["Source", v, "Sink"])
-                self._route[v] = route
-                # Initialize route attributes
-                if self.load_capacity:
-                    route.graph["load"] = self.G.nodes[v]["demand"]
-                if self.duration:
-                    route.graph["time"] = (
-                        self.G.nodes[v]["service_time"]
-                        + self.G.edges["Source", v]["time"]
-                        + self.G.edges[v, "Sink"]["time"]
-                    )
+        """
+        Initialization with round trips (Source - node - Sink).
+        Routes are stored as linked lists (next_node) with their first (head)
+        and last (tail) nodes, route attributes are indexed by route id.
+        is_head[v] (resp. is_tail[v]) tells if v is adjacent to the Source
+        (resp. Sink), so that merges are tested without looking up routes.
+        """
+        n = len(self._nodes)
+        if self._next is None or len(self._next) != n:
+            self._next = empty(n, dtype=int64)
+            self._route_id = empty(n, dtype=int64)
+            self._head = empty(n, dtype=int64)
+            self._tail = empty(n, dtype=int64)
+            self._is_head = empty(n, dtype=bool_)
+            self._is_tail = empty(n, dtype=bool_)
+            self._route_load = empty(n)
+            self._route_time = empty(n)
+            self._route_stops = empty(n, dtype=int64)
+            self._processed = empty(n, dtype=bool_)
+        self._next[:] = -1
+        self._route_id[:] = arange(n)
+        self._head[:] = self._route_id
+        self._tail[:] = self._route_id
+        self._is_head[:] = self._is_tail[:] = True
+        # Initialize route attributes
+        self._route_load[:] = self._demand
+        # Route time is stored without the return to the Sink
+        add(self._source_time, self._service_time, out=self._route_time)
+        self._route_stops[:] = 1
+        self._processed[:] = False
 
     def _update_routes(self):
         """Stores best routes as list of nodes."""
+        self._route = {}
+        self._best_routes = []
         self._best_value = 0
-        for route in list(set(self._route.values())):
-            self._best_value += route.graph["cost"]
-            self._best_routes.append(shortest_path(route, "Source", "Sink"))
+        for rid in unique(self._route_id):
+            # Walk the linked list from the head of the route
+            path = ["Source"]
+            v = self._head[rid]
+            while v != -1:
+                path.append(self._nodes[v])
+                v = self._next[v]
+            path.append("Sink")
+            self._best_value += (
+                self._source_cost[self._head[rid]] + self._sink_cost[self._tail[rid]]
+            )
+            for (i, j) in zip(path[1:-2], path[2:-1]):
+                self._best_value += _first_cost(self.G.edges[i, j]["cost"])
+            for v in path[1:-1]:
+                self._route[v] = path
+            self._best_routes.append(path)
 
-    def _get_savings(self):
-        """Computes Clark & Wright savings and orders edges by non increasing savings."""
-        for (i, j) in self.G.edges():
-            if i != "Source" and j != "Sink":
-                self._savings[(i, j)] = (
-                    self.G.edges[i, "Sink"]["cost"]
-                    + self.G.edges["Source", j]["cost"]
-                    - self.alpha * self.G.edges[i, j]["cost"]
-                    # FOR MORE SOPHISTICATED VERSIONS OF CLARKE WRIGHT:
-                    # + self.beta
-                    # * abs(
-                    #    self.G.edges["Source", i]["cost"]
-                    #    - self.G.edges[j, "Sink"]["cost"]
-                    # )
-                    # + self.gamma
-                    # * (self.G.nodes[i]["demand"] + self.G.nodes[j]["demand"])
-                    # / self._average_demand
-                )
-        self._ordered_edges = sorted(self._savings, key=self._savings.get, reverse=True)
-
-    def _merge_route(self, existing_node, new_node, depot):
+    def _materialize_tables(self):
         """
-        Merges new_node in existing_node's route.
-        Two possibilities:
-            1. If existing_node is a predecessor of Sink, new_node is inserted
-               between existing_node and Sink;
-            2. If existing_node is a successor of Source, new_node is inserted
-               between Source and and existing_node.
+        Stores edge and node attributes in arrays indexed by customer,
+        so that the graph is not queried during the algorithm.
+        Customers are indexed from 0 to n-1 (self._nodes maps indices to nodes).
+        Costs between customers are stored in a dense matrix (inf for missing edges),
+        and has_edge tells which edges exist.
         """
-        route = self._route[existing_node]
-        # Insert new_node between existing_node and Sink
-        if depot == "Sink":
-            add_path(route, [existing_node, new_node, "Sink"])
-            route.remove_edge(existing_node, "Sink")
-            # Update route cost
-            self._route[existing_node].graph["cost"] += (
-                self.G.edges[existing_node, new_node]["cost"]
-                + self.G.edges[new_node, "Sink"]["cost"]
-                - self.G.edges[existing_node, "Sink"]["cost"]
-            )
+        self._nodes = []
+        demand = []
+        service_time = []
+        for (v, data) in self.G.nodes(data=True):
+            if v not in ["Source", "Sink"]:
+                self._nodes.append(v)
+                demand.append(data.get("demand", 0))
+                service_time.append(data.get("service_time", 0))
+        self._demand = array(demand, dtype=float64)
+        self._service_time = array(service_time, dtype=float64)
+        self._index = {v: k for k, v in enumerate(self._nodes)}
+        n = len(self._nodes)
+        # Source (as a tail) and Sink (as a head) are given index n,
+        # so that all edges are stored in a single pass
+        index = dict(self._index)
+        index["Source"] = index["Sink"] = n
+        tails = []
+        heads = []
+        costs = []
+        times = []
+        for (i, j, data) in self.G.edges(data=True):
+            tails.append(index[i])
+            heads.append(index[j])
+            costs.append(_first_cost(data["cost"]))
+            times.append(data.get("time", 0))
+        cost = full((n + 1, n + 1), inf)
+        cost[tails, heads] = costs
+        time = zeros((n + 1, n + 1))
+        time[tails, heads] = times
+        has_edge = zeros((n + 1, n + 1), dtype=bool_)
+        has_edge[tails, heads] = True
+        self._has_edge = has_edge[:n, :n]
+        self._cost = cost[:n, :n]
+        self._source_cost = cost[n, :n]
+        self._sink_cost = cost[:n, n]
+        self._time = time[:n, :n]
+        self._source_time = time[n, :n]
+        self._sink_time = time[:n, n]
+        self._return_time = self._service_time + self._sink_time
 
-        # Insert new_node between Source and existing_node
-        if depot == "Source":
-            add_path(route, ["Source", new_node, existing_node])
-            route.remove_edge("Source", existing_node)
-            # Update route cost
-            self._route[existing_node].graph["cost"] += (
-                self.G.edges[new_node, existing_node]["cost"]
-                + self.G.edges["Source", new_node]["cost"]
-                - self.G.edges["Source", existing_node]["cost"]
-            )
+    def _get_savings(self):
+        """
+        Computes Clark & Wright savings of candidate edges.
+        Only feasible edges are candidates, they are stored by flat index
+        (i * n + j) in self._candidates, and their savings in an array
+        aligned with it (self._savings). Candidates are reused by subsequent
+        runs with the same load capacity and number of stops.
+        """
+        # Candidates only depend on the constraints, not on alpha and beta
+        constraints = (self.load_capacity, self.num_stops)
+        if constraints != self._candidates_constraints:
+            n = len(self._nodes)
+            self._candidates = flatnonzero(self._feasible_edges())
+            self._candidates_ij = unravel_index(self._candidates, (n, n))
+            self._candidates_constraints = constraints
+        i, j = self._candidates_ij
+        savings = (
+            self._sink_cost[i]
+            + self._source_cost[j]
+            - self.alpha * self._cost[i, j]
+            # FOR MORE SOPHISTICATED VERSIONS OF CLARKE WRIGHT:
+            # + self.gamma
+            # * (demand[i] + demand[j])
+            # / self._average_demand
+        )
+        if self.beta:
+            # Paessens' correction
+            savings += self.beta * abs(self._source_cost[i] - self._sink_cost[j])
+        self._savings = savings
 
-        # Update route load
-        if self.load_capacity:
-            self._route[existing_node].graph["load"] += self.G.nodes[new_node]["demand"]
-        # Update route duration
-        if self.duration:
-            self._route[existing_node].graph["time"] += (
-                self.G.edges[existing_node, new_node]["time"]
-                + self.G.edges[new_node, "Sink"]["time"]
-                + self.G.nodes[new_node]["service_time"]
-                - self.G.edges[existing_node, "Sink"]["time"]
-            )
-        # Update processed vertices
-        self._processed_nodes.append(new_node)
-        if existing_node not in self._processed_nodes:
-            self._processed_nodes.append(existing_node)
-
-        self._route[new_node] = route
-        return route
-
-    def _constraints_met(self, existing_node, new_node):
-        """Tests if new_node can be merged in route without violating constraints."""
-        route = self._route[existing_node]
-        # test if new_node already in route
-        if new_node in route.nodes():
-            return False
-        # test capacity constraints
-        if self.load_capacity:
-            if (
-                route.graph["load"] + self.G.nodes[new_node]["demand"]
-                > self.load_capacity
-            ):
-                return False
-        # test duration constraints
-        if self.duration:
-            # this code assumes the times to go from the Source and to the Sink are equal
-            if (
-                route.graph["time"]
-                + self.G.edges[existing_node, new_node]["time"]
-                + self.G.edges[new_node, "Sink"]["time"]
-                + self.G.nodes[new_node]["service_time"]
-                - self.G.edges[existing_node, "Sink"]["time"]
-                > self.duration
-            ):
-                return False
-        # test stop constraints
-        if self.num_stops:
-            # Source and Sink don't count (hence -2)
-            if len(route.nodes()) - 2 + 1 > self.num_stops:
-                return False
-        return True
-
-    def _process_edge(self, i, j):
+    def _ordered_edges(self):
         """
-        Attemps to merge nodes i and j together.
-        Merge is possible if :
-            1. vertices have not been merged already;
-            2. route constraints are met;
-            3. either:
-               a) node i is adjacent to the Source (j is inserted in route[i]);
-               b) or node j is adjacent to the Sink (i is inserted in route[j]).
+        Yields candidate edges by blocks of non increasing savings
+        (ties are broken by index).
+        Only a small prefix of the edges leads to merges, so blocks are
+        selected with a partial sort, starting with 2n edges and doubling.
+        Between two blocks, remaining edges that can no longer be merged
+        (their nodes are processed or inside a route) are dropped, and
+        the generator stops as soon as all nodes are processed.
         """
-        merged = False
-        if (
-            j not in self._processed_nodes  # 1
-            and self._constraints_met(i, j)  # 2
-            and i in self._route[i].predecessors("Sink")  # 3b
-        ):
-            self._merge_route(i, j, "Sink")
-            merged = True
+        n = len(self._nodes)
+        candidates = self._candidates
+        keys = -self._savings
+        block_size = 2 * n
+        while len(candidates) > 0:
+            if len(candidates) > block_size:
+                kth = partition(keys, block_size - 1)[block_size - 1]
+                in_block = keys <= kth
+            else:
+                in_block = ones(len(candidates), dtype=bool_)
+            block = candidates[in_block]
+            block = block[argsort(keys[in_block], kind="stable")]
+            yield unravel_index(block, (n, n))
 
-        if (
-            not merged
-            and j in self.G.predecessors(i)
-            and i not in self._processed_nodes  # 1
-            and self._constraints_met(j, i)  # 2
-            and j in self._route[j].successors("Source")  # 3a
-        ):
-            self._merge_route(j, i, "Source")
+            if self._processed.all():
+                return
+            candidates = candidates[~in_block]
+            keys = keys[~in_block]
+            i, j = unravel_index(candidates, (n, n))
+            alive = (~self._processed[j] & self._is_tail[i]) | (
+                ~self._processed[i] & self._is_head[j]
+            )
+            candidates = candidates[alive]
+            keys = keys[alive]
+            block_size *= 2
 
-    def _format_cost(self):
-        """If list of costs is given, first item of list is considered."""
-        for (i, j) in self.G.edges():
-            if isinstance(self.G.edges[i, j]["cost"], list):
-                self.G.edges[i, j]["cost"] = self.G.edges[i, j]["cost"][0]
+    def _feasible_edges(self):
+        """
+        Screens edges that can never be merged, whatever the routes they belong to.
+        Any route containing i and j has a load of at least demand[i] + demand[j]
+        and at least 2 stops. Duration is not screened, as route durations
+        are not monotonic (times to and from the depot are subtracted).
+        """
+        mask = self._has_edge.copy()
+        if self.load_capacity:
+            mask &= (
+                self._demand[:, None] + self._demand[None, :] <= self.load_capacity
+            )
+        if self.num_stops and self.num_stops < 2:
+            mask[:] = False
+        return mask
 
     @property
     def best_value(self):
@@ -244,6 +588,8 @@ class _RoundTrip:
         self.round_trips = []
 
     def run(self):
-        for v in self.G.nodes():
-            if v not in ["Source", "Sink"]:
-                self.round_trips.append(["Source", v, "Sink"])
+        self.round_trips = [
+            ["Source", v, "Sink"]
+            for v in self.G.nodes()
+            if v not in ["Source", "Sink"]
+        ]
@@ -793,18 +793,17 @@ class VehicleRoutingProblem:
                 not self.periodic):
             best_value = 1e10
             best_num_vehicles = 1e10
+            # Tables and buffers of the algorithm are reused for all alphas
+            alg = _ClarkeWright(
+                self.G,
+                self.load_capacity,
+                self.duration,
+                self.num_stops,
+            )
             for alpha in [x / 10 for x in range(1, 20)]:
                 # for beta in  [x / 10 for x in range(20)]:
                 # for gamma in  [x / 10 for x in range(20)]:
-                alg = _ClarkeWright(
-                    self.G,
-                    self.load_capacity,
-                    self.duration,
-                    self.num_stops,
-                    alpha,
-                    # beta,
-                    # gamma,
-                )
+                alg.alpha = alpha
                 alg.run()
                 self._initial_routes += alg.best_routes
                 if alg.best_value < best_value: